@@ -1,113 +1,203 @@
 import os
 import logging
 import requests
-import yaml
-import json
+import orjson
 import subprocess
-import time
+import mmap
 import sys
+import atexit
+import signal
 from requests.auth import HTTPBasicAuth
-from threading import Thread, Event
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from threading import Thread, Event, current_thread, main_thread
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from collections import deque
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-class Spinner:
-    """Simple spinner animation for long-running operations"""
-    def __init__(self):
-        self.spinner_chars = ['⠋', '⠙', '⠹', '⠸', '⠼', '⠴', '⠦', '⠧', '⠇', '⠏']
-        self.stop_event = Event()
-        self.spinner_thread = None
-
-    def start(self, message):
-        """Start the spinner with a message"""
-        self.stop_event.clear()
-        self.spinner_thread = Thread(target=self._spin, args=(message,))
-        self.spinner_thread.start()
-
-    def stop(self):
-        """Stop the spinner"""
-        self.stop_event.set()
-        if self.spinner_thread:
-            self.spinner_thread.join()
+SPINNER_CHARS = ['⠋', '⠙', '⠹', '⠸', '⠼', '⠴', '⠦', '⠧', '⠇', '⠏']
+
+def _spinner_enabled():
+    """Only animate on an interactive terminal outside of CI, and never from worker threads"""
+    return (
+        sys.stdout.isatty()
+        and not os.environ.get("CI")
+        and current_thread() is main_thread()
+    )
+
+def _spin(message, stop_event):
+    """Run the spinner animation"""
+    i = 0
+    while not stop_event.is_set():
+        sys.stdout.write(f'\r{SPINNER_CHARS[i]} {message}')
+        sys.stdout.flush()
+        stop_event.wait(0.1)
+        i = (i + 1) % len(SPINNER_CHARS)
+
+@contextmanager
+def spinner(message):
+    """Show a spinner animation while the wrapped block runs (no-op for batch runs)"""
+    if not _spinner_enabled():
+        yield
+        return
+    stop_event = Event()
+    spinner_thread = Thread(target=_spin, args=(message, stop_event), daemon=True)
+    spinner_thread.start()
+    try:
+        yield
+    finally:
+        stop_event.set()
+        spinner_thread.join()
         sys.stdout.write('\r' + ' ' * 100 + '\r')  # Clear the line
         sys.stdout.flush()
 
-    def _spin(self, message):
-        """Run the spinner animation"""
-        i = 0
-        while not self.stop_event.is_set():
-            sys.stdout.write(f'\r{self.spinner_chars[i]} {message}')
-            sys.stdout.flush()
-            time.sleep(0.1)
-            i = (i + 1) % len(self.spinner_chars)
+def read_json_file(path):
+    """Parse a JSON file through a read-only memory map, without copying it onto the heap"""
+    with open(path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as buffer:
+                return orjson.loads(buffer)
+
+def load_yaml_cached(path):
+    """Load a YAML file, reusing a JSON sidecar cache while the source file is unchanged"""
+    cache_path = f"{path}.cache.json"
+    # Size as well as mtime, since cp -p / rsync -a replacements keep the mtime
+    src_stat = os.stat(path)
+    src_stamp = [src_stat.st_mtime_ns, src_stat.st_size]
+    try:
+        cached = read_json_file(cache_path)
+        if cached['_src_stamp'] == src_stamp:
+            return cached['config']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass  # Missing, corrupt or stale cache: fall back to parsing the YAML
+    
+    # Imported here so yaml is only paid for on a cache miss
+    import yaml
+    try:
+        from yaml import CSafeLoader
+    except ImportError:
+        from yaml import SafeLoader as CSafeLoader
+    
+    with open(path, 'r') as file:
+        config = yaml.load(file, Loader=CSafeLoader)
+    
+    # Only cache configs that survive a JSON round trip unchanged (YAML dates,
+    # for instance, would come back as strings)
+    try:
+        payload = orjson.dumps({'_src_stamp': src_stamp, 'config': config})
+        if orjson.loads(payload)['config'] != config:
+            logging.debug(f"Not caching {path}: it contains values JSON cannot represent")
+            return config
+        
+        # The cache holds the same credentials as the YAML, so keep it private
+        tmp_path = f"{cache_path}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as file:
+            file.write(payload)
+        os.replace(tmp_path, cache_path)
+    except (OSError, TypeError) as e:
+        logging.debug(f"Could not write config cache {cache_path}: {e}")
+    return config
 
 def load_config():
     """Load configuration from YAML file"""
-    spinner = Spinner()
-    spinner.start("Loading configuration from config.yaml...")
     try:
-        with open('config.yaml', 'r') as file:
-            config = yaml.safe_load(file)
-            spinner.stop()
-            logging.info("✓ Configuration loaded successfully")
-            return config
+        with spinner("Loading configuration from config.yaml..."):
+            config = load_yaml_cached('config.yaml')
+        logging.info("✓ Configuration loaded successfully")
+        return config
     except Exception as e:
-        spinner.stop()
         logging.error(f"✗ Failed to load config.yaml: {e}")
         return None
 
 def load_input_json():
     """Load input JSON file"""
-    spinner = Spinner()
-    spinner.start("Loading input data from test_input.json...")
     try:
-        with open('test_input.json', 'r') as file:
-            data = json.load(file)
-            spinner.stop()
-            logging.info("✓ Input data loaded successfully")
-            return data
+        with spinner("Loading input data from test_input.json..."):
+            data = read_json_file('test_input.json')
+        # None is reserved for "failed to load"
+        if data is None:
+            raise ValueError("expected a JSON object, got null")
+        logging.info("✓ Input data loaded successfully")
+        return data
     except Exception as e:
-        spinner.stop()
         logging.error(f"✗ Failed to load test_input.json: {e}")
         return None
 
-def create_application(config, input_data):
+def create_session(cast_config, pool_size):
+    """Create the HTTP session shared by all CAST API calls"""
+    session = requests.Session()
+    # Verify against the configured CA bundle (e.g. for a self-signed server)
+    # or requests' default one; pooled connections let TLS sessions be resumed
+    session.verify = cast_config.get('ca_bundle') or True
+    session.auth = HTTPBasicAuth(cast_config['login'], cast_config['password'])
+    # Creating an application (POST) is not idempotent: the server may have created
+    # it before a read timeout or 5xx, so only GETs are retried on those. POSTs are
+    # still retried on connection errors, where the request never reached the server.
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"])
+    )
+    session.mount('https://', HTTPAdapter(pool_maxsize=pool_size, max_retries=retry))
+    return session
+
+def list_applications(session, config, failure_note="creating all"):
+    """Fetch the applications that already exist in the domain as a {name: id} map"""
+    try:
+        cast_config = config['cast']
+        company_id = cast_config['company_id']
+        url = f"{cast_config['base_url']}/domains/{company_id}/applications"
+        
+        with spinner("Fetching existing applications from CAST Highlight API..."):
+            response = session.get(url, timeout=(5, 30))
+        
+        if response.status_code == 200:
+            apps = orjson.loads(response.content)
+            existing = {app['name']: app['id'] for app in apps if app.get('name') and app.get('id')}
+            logging.info(f"✓ Found {len(existing)} existing applications")
+            return existing
+        else:
+            logging.warning(f"Could not list applications (status code {response.status_code}); {failure_note}")
+            return {}
+            
+    except Exception as e:
+        logging.warning(f"Could not list applications ({e}); {failure_note}")
+        return {}
+
+def create_application(session, config, app_name, domain_id):
     """Create a new application in CAST Highlight"""
-    spinner = Spinner()
     try:
         # Get credentials from config
         cast_config = config['cast']
         company_id = cast_config['company_id']
         url = f"{cast_config['base_url']}/domains/{company_id}/applications"
         
-        # Get repository name from input JSON
-        repo_name = input_data['repositories'][0]['name']
-        app_name = f"{repo_name}-analysis"
-        
-        payload = [{
+        payload = orjson.dumps([{
             "name": app_name,
-            "domains": [{"id": int(company_id)}]
-        }]
+            "domains": [{"id": domain_id}]
+        }])
 
         headers = {
             'Content-Type': 'application/json'
         }
 
         logging.info(f"Creating application '{app_name}' in domain {company_id}")
-        spinner.start("Sending request to CAST Highlight API...")
-
-        response = requests.post(
-            url,
-            headers=headers,
-            auth=HTTPBasicAuth(cast_config['login'], cast_config['password']),
-            json=payload,
-            verify=False
-        )
+        with spinner("Sending request to CAST Highlight API..."):
+            response = session.post(
+                url,
+                headers=headers,
+                data=payload,
+                timeout=(5, 30)
+            )
         
-        spinner.stop()
         if response.status_code == 200:
-            app_data = response.json()
+            app_data = orjson.loads(response.content)
             if app_data.get('result') and app_data['result'][0].get('id'):
                 app_id = app_data['result'][0]['id']
                 logging.info(f"✓ Successfully created application with ID: {app_id}")
@@ -121,58 +211,206 @@ def create_application(config, input_data):
             return None
             
     except Exception as e:
-        spinner.stop()
         logging.error(f"✗ Error creating application: {e}")
         return None
 
-def scan_repository(app_id, config, input_data):
+def start_scanner_container(cast_config):
+    """Start a long-lived CAST Highlight CLI container and return the docker exec prefix for scans"""
+    result = subprocess.run(
+        [
+            "docker", "run", "-d", "--rm",
+            "-v", "/tmp:/workingDir",
+            "--entrypoint", "/bin/sh",
+            cast_config['docker_image'],
+            "-c", "sleep infinity"
+        ],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    container_id = result.stdout.strip()
+    remove_container = partial(subprocess.run, ["docker", "rm", "-f", container_id], capture_output=True)
+    atexit.register(remove_container)
+    
+    # atexit doesn't run on SIGTERM (e.g. a cancelled CI job), which would leave the
+    # container sleeping forever; remove it right away, which also ends running scans,
+    # then exit normally
+    def _on_sigterm(signum, frame):
+        atexit.unregister(remove_container)
+        remove_container()
+        sys.exit(128 + signum)
+    signal.signal(signal.SIGTERM, _on_sigterm)
+    
+    # The image's own entrypoint is the CLI we overrode above
+    result = subprocess.run(
+        ["docker", "image", "inspect", "--format", "{{json .Config.Entrypoint}}", cast_config['docker_image']],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    entrypoint = orjson.loads(result.stdout) or []
+    logging.info(f"✓ Started CAST Highlight CLI container {container_id[:12]}")
+    return ["docker", "exec", container_id, *entrypoint]
+
+def _mask_password(command):
+    """Render a command for logging with the --password value hidden"""
+    try:
+        i = command.index("--password")
+        masked = command[:i + 1] + ["********"] + command[i + 2:]
+    except ValueError:
+        masked = command
+    return " ".join(masked)
+
+def _tail(path, lines=20):
+    """Return the last lines of a text file, for surfacing errors from a log file"""
+    with open(path, 'r', errors='replace') as file:
+        return ''.join(deque(file, maxlen=lines))
+
+def scan_repository(app_id, config, repository, scanner_command):
     """Scan a GitHub repository using CAST Highlight CLI"""
-    spinner = Spinner()
+    repo_name = repository['name']
     try:
         cast_config = config['cast']
-        repo_url = input_data['repositories'][0]['repositoryLocation']['url']
+        repo_url = repository['repositoryLocation']['url']
         
-        # Construct the CLI command to use Docker's internal directories
+        # Construct the CLI command to use Docker's internal directories; each
+        # scan gets its own source and working directories since the container is shared
         command = [
-            "docker", "run", "--rm",
-            "-v", "/tmp:/workingDir",
-            cast_config['docker_image'],
+            *scanner_command,
             "--gitUrl", repo_url,
-            "--sourceDir", "/app",  # Use Docker container's internal directory
-            "--workingDir", "/workingDir",
+            "--sourceDir", f"/app/{app_id}",  # Use Docker container's internal directory
+            "--workingDir", f"/workingDir/{app_id}",
             "--applicationId", str(app_id),
             "--companyId", cast_config['company_id'],
             "--login", cast_config['login'],
             "--password", cast_config['password']
         ]
         
-        logging.info("Starting repository scan...")
-        spinner.start("Running CAST Highlight analysis (this may take several minutes)...")
+        # With output.log_to_files turned on, the CLI writes straight to log files
+        # under output.base_dir instead of being captured in memory
+        output_config = config.get('output') or {}
+        log_dir = output_config.get('base_dir') if output_config.get('log_to_files', False) else None
         
-        # Run the command
-        result = subprocess.run(
-            command,
+        logging.info(f"Starting scan of '{repo_name}' (application {app_id})...")
+        
+        # Create the per-scan working directory inside the shared container
+        subprocess.run(
+            [*scanner_command[:3], "mkdir", "-p", f"/workingDir/{app_id}"],
             capture_output=True,
             text=True,
             check=True
         )
         
-        spinner.stop()
-        logging.info("✓ Scan completed successfully")
-        logging.info(result.stdout)
+        # Run the command
+        with spinner("Running CAST Highlight analysis (this may take several minutes)..."):
+            if log_dir:
+                os.makedirs(log_dir, exist_ok=True)
+                stdout_path = os.path.join(log_dir, f"scan-{app_id}.stdout.log")
+                stderr_path = os.path.join(log_dir, f"scan-{app_id}.stderr.log")
+                with open(stdout_path, 'wb') as stdout_log, open(stderr_path, 'wb') as stderr_log:
+                    result = subprocess.run(
+                        command,
+                        stdout=stdout_log,
+                        stderr=stderr_log,
+                        check=True
+                    )
+            else:
+                result = subprocess.run(
+                    command,
+                    capture_output=True,
+                    text=True,
+                    check=True
+                )
+        
+        logging.info(f"✓ Scan of '{repo_name}' completed successfully")
+        if log_dir:
+            logging.info(f"✓ Scan output for '{repo_name}' written to {stdout_path}")
+        elif logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(result.stdout)
         return True
         
     except subprocess.CalledProcessError as e:
-        spinner.stop()
-        logging.error(f"✗ Scan failed with error: {e}")
-        logging.error(f"✗ Command output: {e.stdout}")
-        logging.error(f"✗ Command error: {e.stderr}")
+        logging.error(f"✗ Scan of '{repo_name}' failed with exit code {e.returncode}: {_mask_password(e.cmd)}")
+        if e.stderr is None:
+            # The CLI wrote to log files rather than to captured pipes
+            logging.error(f"✗ Command output for '{repo_name}': {stdout_path}")
+            logging.error(f"✗ Command error for '{repo_name}' ({stderr_path}):\n{_tail(stderr_path)}")
+        else:
+            logging.error(f"✗ Command output for '{repo_name}': {e.stdout}")
+            logging.error(f"✗ Command error for '{repo_name}': {e.stderr}")
         return False
     except Exception as e:
-        spinner.stop()
-        logging.error(f"✗ Error during scan: {e}")
+        logging.error(f"✗ Error during scan of '{repo_name}': {e}")
         return False
 
+def _repository_key(repository):
+    """Identify an input repository entry by the name its application is derived from"""
+    name = repository.get('name') if isinstance(repository, dict) else None
+    # Malformed entries get a unique key and are reported by process_repository
+    return name if isinstance(name, str) else id(repository)
+
+def _repository_url(repository):
+    """Return an input repository entry's URL, or None when it is malformed"""
+    try:
+        return repository['repositoryLocation']['url']
+    except (KeyError, TypeError):
+        return None
+
+def dedupe_repositories(input_repositories):
+    """Drop repeated repository entries; return the unique ones and how many were rejected"""
+    # The application name (and with it the scan directories and log files) derives
+    # from the repository name, so entries sharing a name but not a URL would scan
+    # over each other and are rejected
+    seen = {}
+    repositories = []
+    duplicates = rejected = 0
+    for repository in input_repositories:
+        # Malformed entries are kept as-is and reported by process_repository
+        first = seen.setdefault(_repository_key(repository), repository)
+        if first is repository:
+            repositories.append(repository)
+        elif _repository_url(repository) == _repository_url(first):
+            duplicates += 1
+        else:
+            logging.error(
+                f"✗ Skipping repository '{repository['name']}' ({_repository_url(repository)}): "
+                f"name already used by {_repository_url(first)}"
+            )
+            rejected += 1
+    if duplicates:
+        logging.info(f"Skipping {duplicates} duplicate repository entries")
+    return repositories, rejected
+
+def process_repository(session, config, repository, domain_id, scanner_command, existing_apps):
+    """Create the application for a repository (unless it already exists) and scan it"""
+    repo_name = repository.get('name') if isinstance(repository, dict) else None
+    if not isinstance(repo_name, str) or _repository_url(repository) is None:
+        logging.error(f"✗ Invalid repository entry {repository!r}: expected a string 'name' and 'repositoryLocation.url'")
+        return False
+    
+    logging.info(f"Processing repository '{repo_name}'")
+    app_name = f"{repo_name}-analysis"
+    
+    # Reuse the existing application or create it
+    app_id = existing_apps.get(app_name)
+    if app_id:
+        logging.info(f"✓ Using existing application '{app_name}' with ID: {app_id}")
+    else:
+        app_id = create_application(session, config, app_name, domain_id)
+        if not app_id:
+            # The create may have succeeded server-side despite the error response
+            app_id = list_applications(
+                session, config,
+                failure_note=f"could not confirm whether '{app_name}' exists"
+            ).get(app_name)
+            if app_id:
+                logging.info(f"✓ Found application '{app_name}' with ID: {app_id} after failed create")
+    if not app_id:
+        return False
+    
+    # Scan repository
+    return scan_repository(app_id, config, repository, scanner_command)
+
 def main():
     logging.info("=" * 80)
     logging.info("Starting CAST Highlight Analysis Process")
@@ -185,16 +423,64 @@ def main():
     
     # Load input JSON
     input_data = load_input_json()
-    if not input_data:
+    if input_data is None:
         return
     
-    # Create application
-    app_id = create_application(config, input_data)
-    if not app_id:
+    input_repositories = input_data.get('repositories') if isinstance(input_data, dict) else None
+    if not isinstance(input_repositories, list) or not input_repositories:
+        logging.error("✗ test_input.json must contain a non-empty 'repositories' list")
         return
     
-    # Scan repository
-    if not scan_repository(app_id, config, input_data):
+    try:
+        domain_id = int(config['cast']['company_id'])
+        processing = config.get('processing') or {}
+        if not isinstance(processing, dict):
+            raise TypeError(f"processing must be a mapping, got {processing!r}")
+        max_parallel = processing.get('max_parallel')
+        max_parallel = 4 if max_parallel is None else int(max_parallel)
+        if max_parallel < 1:
+            raise ValueError(f"processing.max_parallel must be at least 1, got {max_parallel}")
+        # Reuse one connection pool (and TLS session) for every CAST API call,
+        # sized so every worker thread can keep its connection alive
+        session = create_session(config['cast'], pool_size=max_parallel)
+    except (KeyError, TypeError, ValueError, OverflowError) as e:
+        logging.error(f"✗ Invalid configuration in config.yaml: {e}")
+        return
+    
+    # Start the CAST Highlight CLI container once for all scans
+    try:
+        with spinner("Starting CAST Highlight CLI container..."):
+            scanner_command = start_scanner_container(config['cast'])
+    except (subprocess.CalledProcessError, OSError) as e:
+        logging.error(f"✗ Failed to start CAST Highlight CLI container: {e}")
+        if getattr(e, 'stderr', None):
+            logging.error(f"✗ Command error: {e.stderr}")
+        return
+    
+    # Identical entries would create and scan the same application twice
+    repositories, rejected = dedupe_repositories(input_repositories)
+    
+    # One list call up front instead of a create attempt per repository
+    existing_apps = list_applications(session, config)
+    process = partial(
+        process_repository,
+        session, config,
+        domain_id=domain_id,
+        scanner_command=scanner_command,
+        existing_apps=existing_apps
+    )
+    
+    # Repositories are independent, so process them concurrently (bounded by
+    # processing.max_parallel to avoid rate limits); a single repository runs inline
+    if len(repositories) == 1:
+        results = [process(repositories[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_parallel, len(repositories))) as executor:
+            results = list(executor.map(process, repositories))
+    
+    failed = results.count(False) + rejected
+    if failed:
+        logging.error(f"✗ {failed} of {len(repositories) + rejected} repositories failed")
         return
     
     logging.info("=" * 80)